@@ -0,0 +1,432 @@
+"""
+Tests of the image search of pytest-vncmatch against a fake VNC client.
+
+Copyright 2022 Stefan Schuermans <stefan@schuermans.info>
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import concurrent.futures
+import os
+import time
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy
+import pytest
+
+import vncmatch
+
+
+class FakeVNC:
+    """
+    Fake VNC client object that shows a screen, optionally changing to
+    another screen after some time.
+    """
+    def __init__(self,
+                 screen_bgr: numpy.array,
+                 alpha: int = 255,
+                 later_bgr: Optional[numpy.array] = None,
+                 later_time: float = 0.0):
+        """
+        Initialize fake VNC client object:
+        screen_bgr -- OpenCV2 image (BGR) of the screen
+        alpha -- value of the alpha channel of the screen
+        later_bgr -- OpenCV2 image (BGR) of the screen after some time
+        later_time -- number of seconds after which later_bgr is shown
+        """
+        # pytest_vnc captures the screen as RGBA
+        self.screens = []
+        for bgr in (screen_bgr, later_bgr):
+            if bgr is not None:
+                screen = cv2.cvtColor(bgr, cv2.COLOR_BGR2RGBA)
+                screen[:, :, 3] = alpha
+                self.screens.append(screen)
+        self.later_time = time.time() + later_time
+        self.capture_times: List[float] = []  # start times of captures
+        self.capturing = False
+
+    def capture(self) -> numpy.array:
+        """
+        Capture the screen.
+        """
+        # pytest_vnc is not thread-safe
+        assert not self.capturing, 'concurrent capture'
+        self.capturing = True
+        now = time.time()
+        self.capture_times.append(now)
+        time.sleep(0.01)  # capturing takes some time
+        self.capturing = False
+        return self.screens[-1 if now >= self.later_time else 0].copy()
+
+
+def reference_coords(screen_bgr: numpy.array, img: numpy.array) -> list:
+    """
+    Find the image on the screen the straight forward way with OpenCV2's
+    template matching and keep only the best of close-by matches.
+    """
+    img_h, img_w, _channels = img.shape
+    threshold = 0.5 * img_h * img_w
+    values = cv2.matchTemplate(screen_bgr, img, method=cv2.TM_SQDIFF)
+    # recompute values exactly, template matching is not exact in float
+    hit_y, hit_x = numpy.nonzero(values <= threshold + 1.0)
+    hit_values = numpy.array([
+        numpy.square(screen_bgr[y:y + img_h, x:x + img_w].astype(numpy.int64) -
+                     img).sum() for y, x in zip(hit_y, hit_x)
+    ], numpy.int64).reshape(-1)
+    is_hit = hit_values <= threshold
+    hit_y, hit_x, hit_values = hit_y[is_hit], hit_x[is_hit], hit_values[is_hit]
+    coords = []
+    for y, x, value in zip(hit_y, hit_x, hit_values):
+        # dropped if better match (or equal and earlier) within window
+        in_window = ((hit_y - y >= -(img_h // 2)) &
+                     (hit_y - y < img_h - img_h // 2) &
+                     (hit_x - x >= -(img_w // 2)) &
+                     (hit_x - x < img_w - img_w // 2))
+        better = ((hit_values < value) | ((hit_values == value) &
+                                          ((hit_y < y) |
+                                           ((hit_y == y) & (hit_x < x)))))
+        if not (in_window & better).any():
+            coords.append((x, y, x + img_w - 1, y + img_h - 1))
+    return coords
+
+
+def make_screen(seed: int) -> numpy.array:
+    """
+    Make a screen with a plain background, some noise and copies of the
+    button images, some of them slightly changed or overlapping.
+    """
+    rng = numpy.random.default_rng(seed)
+    screen = numpy.full((300, 400, 3), 190, numpy.uint8)
+    noise_y, noise_x = rng.integers(0, 300, 500), rng.integers(0, 400, 500)
+    screen[noise_y, noise_x] = rng.integers(0, 256, (500, 3))
+    for button in ('1', '2', 'plus'):
+        img = cv2.imread(os.path.join('images', f'button_{button:s}.png'))
+        img_h, img_w, _channels = img.shape
+        for _ in range(3):
+            y, x = rng.integers(0, 300 - img_h), rng.integers(0, 400 - img_w)
+            screen[y:y + img_h, x:x + img_w] = img
+            # change a few pixels a little bit, sometimes too much
+            change_y = rng.integers(0, img_h, 4)
+            change_x = rng.integers(0, img_w, 4)
+            screen[y + change_y, x + change_x] ^= numpy.uint8(
+                rng.integers(1, 16))
+    return screen
+
+
+@pytest.mark.parametrize('seed', range(4))
+def test_find_img_matches_reference(seed):
+    """
+    Check that the image search finds the same images as OpenCV2's template
+    matching on the RGBA screen captured by pytest_vnc.
+    """
+    screen_bgr = make_screen(seed)
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    for button in ('1', '2', 'plus', '9'):
+        imgname = os.path.join('images', f'button_{button:s}.png')
+        fi_res = vncm.find_img(imgname)
+        img = cv2.imread(imgname)
+        assert fi_res.coord_list == reference_coords(screen_bgr, img)
+        assert numpy.array_equal(fi_res.screen, screen_bgr)
+
+
+@pytest.mark.parametrize('alpha', [0, 128])
+def test_find_img_ignores_alpha(alpha):
+    """
+    Check that the alpha channel of the captured screen does not influence
+    the image search.
+    """
+    screen_bgr = make_screen(0)
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr, alpha))
+    for button in ('1', '2', 'plus'):
+        imgname = os.path.join('images', f'button_{button:s}.png')
+        img = cv2.imread(imgname)
+        assert vncm.find_img(imgname).coord_list == reference_coords(
+            screen_bgr, img)
+
+
+@pytest.mark.parametrize('size', [(3, 4), (8, 8)])
+def test_find_flat_img_matches_reference(size):
+    """
+    Check that the image search finds the same images as OpenCV2's template
+    matching for a uniform search image on a large area of the same gray
+    value but a different color, which needs a full search.
+    """
+    screen_bgr = make_screen(0)
+    img = numpy.zeros(size + (3, ), numpy.uint8)
+    img[:, :, 0] = 255
+    screen_bgr[200:300, :200] = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)[0, 0]
+    img_h, img_w = size
+    for y, x in ((210, 20), (250, 150), (290, 300), (10, 10)):
+        screen_bgr[y:y + img_h, x:x + img_w] = img
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    fi_res = vncm.find(img)
+    assert len(fi_res.coord_list) == 4
+    assert fi_res.coord_list == reference_coords(screen_bgr, img)
+
+
+def make_flat_screen(img: numpy.array,
+                     positions: List[Tuple[int, int]]) -> numpy.array:
+    """
+    Make a screen with a large area of the same gray value as the uniform
+    search image, but a different color, so searching needs a full search,
+    and copies of the search image at the positions (y top, x left).
+    """
+    img_h, img_w, _channels = img.shape
+    screen_bgr = make_screen(0)
+    screen_bgr[:, :200] = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)[0, 0]
+    for y, x in positions:
+        screen_bgr[y:y + img_h, x:x + img_w] = img
+    return screen_bgr
+
+
+def test_find_flat_img_stops_early():
+    """
+    Check that the full search stops after the first band if it already
+    contains more matches than of interest, but not before.
+    """
+    img = numpy.zeros((8, 8, 3), numpy.uint8)
+    img[:, :, 0] = 255
+    screen_bgr = make_flat_screen(img, [(10, 20), (30, 100), (280, 150)])
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    reference = reference_coords(screen_bgr, img)
+    assert len(reference) == 3
+    assert vncm.find(img, max_matches=1).coord_list == reference[:2]
+    assert vncm.find(img).coord_list == reference
+    screen_bgr = make_flat_screen(img, [(10, 20), (280, 150)])
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    reference = reference_coords(screen_bgr, img)
+    assert len(reference) == 2
+    assert vncm.find(img, max_matches=1).coord_list == reference
+
+
+@pytest.mark.parametrize('offset', range(-6, 3))
+def test_find_flat_img_at_band_edge(offset):
+    """
+    Check that a single match close to the end of the first band of the full
+    search is found exactly once when the search may stop early.
+    """
+    img = numpy.zeros((8, 8, 3), numpy.uint8)
+    img[:, :, 0] = 255
+    out_h = make_screen(0).shape[0] - img.shape[0] + 1
+    band_end = out_h // vncmatch._FULL_SEARCH_BANDS
+    screen_bgr = make_flat_screen(img, [(band_end + offset, 50)])
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    fi_res = vncm.find(img, max_matches=1)
+    assert len(fi_res.coord_list) == 1
+    assert fi_res.coord_list == reference_coords(screen_bgr, img)
+
+
+def test_find_flat_img_better_in_next_band():
+    """
+    Check that matches at the end of the first band of the full search are
+    not counted before the next band is known: two matches in the last row
+    of the first band are both suppressed by a better match in the first row
+    of the next band, so only that one is found.
+    """
+    img = numpy.zeros((8, 8, 3), numpy.uint8)
+    img[:, :, 0] = 255
+    out_h = make_screen(0).shape[0] - img.shape[0] + 1
+    y = out_h // vncmatch._FULL_SEARCH_BANDS - 1
+    x = 50
+    # area of 9 x 14 pixels, i.e. 2 x 7 positions that match
+    screen_bgr = make_flat_screen(img, [(y, x), (y, x + 6), (y + 1, x),
+                                        (y + 1, x + 6)])
+    # first row: positions x and x + 6 better than the ones in between
+    screen_bgr[y, x + 3:x + 6, 0] = 254
+    screen_bgr[y, x + 8:x + 11, 0] = 254
+    # last row: positions x to x + 4 of second row better than the others
+    screen_bgr[y + 8, x + 12:x + 14, 0] = 254
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    reference = reference_coords(screen_bgr, img)
+    assert reference == [(x, y + 1, x + 7, y + 8)]
+    assert vncm.find(img, max_matches=1).coord_list == reference
+
+
+@pytest.mark.parametrize('extra_rows', range(4))
+def test_find_flat_img_on_low_screen(extra_rows):
+    """
+    Check the full search that may stop early on a screen that is only a few
+    rows higher than the search image, i.e. with fewer rows of positions
+    than bands.
+    """
+    img = numpy.zeros((18, 4, 3), numpy.uint8)
+    img[:, :, 0] = 255
+    screen_bgr = numpy.full((18 + extra_rows, 1200, 3),
+                            cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)[0, 0],
+                            numpy.uint8)
+    screen_bgr[extra_rows:, 100:104] = img
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    fi_res = vncm.find(img, max_matches=1)
+    assert fi_res.coord_list == [(100, extra_rows, 103, 17 + extra_rows)]
+
+
+def test_expect_single_img_batch():
+    """
+    Check that the centers of images found exactly once are returned.
+    """
+    vncm = vncmatch.VNCMatch(FakeVNC(make_screen(0)))
+    assert vncm.expect_single_img_batch([]) == {}
+    imgname = os.path.join('images', 'button_9.png')
+    img = cv2.imread(imgname)
+    img_h, img_w, _channels = img.shape
+    screen_bgr = make_screen(0)
+    screen_bgr[100:100 + img_h, 200:200 + img_w] = img
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    middle = (200 + (img_w - 1) // 2, 100 + (img_h - 1) // 2)
+    assert vncm.expect_single_img(imgname) == middle
+    assert vncm.expect_single_img_batch([imgname]) == {imgname: middle}
+
+
+def test_expect_single_img_batch_fail(tmp_path, monkeypatch):
+    """
+    Check that all images that are not found exactly once are reported.
+    """
+    imgnames = [
+        os.path.abspath(os.path.join('images', f'button_{button:s}.png'))
+        for button in ('1', '9', 'equals')
+    ]
+    screen_bgr = make_screen(0)
+    img = cv2.imread(imgnames[0])
+    img_h, img_w, _channels = img.shape
+    screen_bgr[:img_h, :img_w] = img
+    screen_bgr[-img_h:, -img_w:] = img
+    # error information is output to the current directory
+    monkeypatch.chdir(tmp_path)
+    vncm = vncmatch.VNCMatch(FakeVNC(screen_bgr))
+    with pytest.raises(AssertionError) as exc_info:
+        vncm.expect_single_img_batch(imgnames)
+    msg = str(exc_info.value)
+    assert f'image {imgnames[0]:s} found multiple times' in msg
+    assert f'image {imgnames[1]:s} not found' in msg
+    assert f'image {imgnames[2]:s} not found' in msg
+    assert len(os.listdir(tmp_path / 'vncmatch_fails')) == 3
+
+
+def make_img_screens(imgname: str) -> Tuple[numpy.array, numpy.array]:
+    """
+    Make a screen without and a screen with the image.
+    """
+    img = cv2.imread(imgname)
+    img_h, img_w, _channels = img.shape
+    screen_bgr = make_screen(0)
+    later_bgr = screen_bgr.copy()
+    later_bgr[100:100 + img_h, 200:200 + img_w] = img
+    return screen_bgr, later_bgr
+
+
+def test_expect_single_img_timeout():
+    """
+    Check waiting for an image to appear within the timeout.
+    """
+    imgname = os.path.join('images', 'button_9.png')
+    screen_bgr, later_bgr = make_img_screens(imgname)
+    vnc = FakeVNC(screen_bgr, later_bgr=later_bgr, later_time=0.3)
+    vncm = vncmatch.VNCMatch(vnc)
+    start = time.time()
+    assert vncm.expect_single_img(imgname, timeout=2.0) == (220, 113)
+    assert time.time() - start < 1.0
+    # short waits at first, longer ones later
+    assert 3 <= len(vnc.capture_times) <= 10
+
+
+@pytest.mark.parametrize('later_time', [0.3, 0.55])
+def test_expect_single_img_timeout_last_capture(later_time):
+    """
+    Check that the screen is captured again when the timeout expires, so an
+    image appearing shortly before is found.
+    """
+    imgname = os.path.join('images', 'button_9.png')
+    screen_bgr, later_bgr = make_img_screens(imgname)
+    vnc = FakeVNC(screen_bgr, later_bgr=later_bgr, later_time=later_time)
+    vncm = vncmatch.VNCMatch(vnc)
+    assert vncm.expect_single_img(imgname, timeout=0.6) == (220, 113)
+
+
+def test_expect_single_img_timeout_fail(tmp_path, monkeypatch):
+    """
+    Check that an image appearing after the timeout is not found, that the
+    screen has been captured after the timeout expired and that the
+    unchanged screen has been searched only once.
+    """
+    imgname = os.path.abspath(os.path.join('images', 'button_9.png'))
+    screen_bgr, later_bgr = make_img_screens(imgname)
+    monkeypatch.chdir(tmp_path)
+    vnc = FakeVNC(screen_bgr, later_bgr=later_bgr, later_time=1.0)
+    vncm = vncmatch.VNCMatch(vnc)
+    searches = []
+    search = vncm._search
+    monkeypatch.setattr(vncm, '_search',
+                        lambda *args: searches.append(args) or search(*args))
+    start = time.time()
+    with pytest.raises(AssertionError, match='not found'):
+        vncm.expect_single_img(imgname, timeout=0.5)
+    assert max(vnc.capture_times) >= start + 0.5
+    assert len(vnc.capture_times) <= 10
+    assert len(searches) == 1
+
+
+def test_expect_single_img_no_timeout(tmp_path, monkeypatch):
+    """
+    Check that the screen is captured exactly once without timeout and that
+    no thread pool is used for a single image then.
+    """
+    pools = []
+    pool = concurrent.futures.ThreadPoolExecutor
+    monkeypatch.setattr(concurrent.futures, 'ThreadPoolExecutor',
+                        lambda *args: pools.append(args) or pool(*args))
+    imgname = os.path.abspath(os.path.join('images', 'button_9.png'))
+    screen_bgr, later_bgr = make_img_screens(imgname)
+    monkeypatch.chdir(tmp_path)
+    vnc = FakeVNC(later_bgr)
+    assert vncmatch.VNCMatch(vnc).expect_single_img(imgname) == (220, 113)
+    assert len(vnc.capture_times) == 1
+    vnc = FakeVNC(screen_bgr)
+    with pytest.raises(AssertionError, match='not found'):
+        vncmatch.VNCMatch(vnc).expect_single_img(imgname)
+    assert len(vnc.capture_times) == 1
+    assert pools == []
+
+
+def test_expect_single_img_batch_capture_while_searching(monkeypatch):
+    """
+    Check that the next screen is captured while a slow search is still
+    running.
+    """
+    imgnames = [
+        os.path.join('images', f'button_{button:s}.png')
+        for button in ('1', '9')
+    ]
+    screen_bgr, later_bgr = make_img_screens(imgnames[1])
+    img = cv2.imread(imgnames[0])
+    img_h, img_w, _channels = img.shape
+    later_bgr[200:200 + img_h, 300:300 + img_w] = img
+    vnc = FakeVNC(screen_bgr, later_bgr=later_bgr, later_time=0.3)
+    vncm = vncmatch.VNCMatch(vnc)
+    searching = []  # (start time, end time) of searches
+    search = vncm._search
+
+    def slow_search(*args):
+        start = time.time()
+        time.sleep(0.1)
+        fi_res = search(*args)
+        searching.append((start, time.time()))
+        return fi_res
+
+    monkeypatch.setattr(vncm, '_search', slow_search)
+    coords = vncm.expect_single_img_batch(imgnames, timeout=2.0)
+    assert coords == {imgnames[0]: (320, 213), imgnames[1]: (220, 113)}
+    assert any(start < capture_time < end
+               for capture_time in vnc.capture_times
+               for start, end in searching)
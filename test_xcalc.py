@@ -21,6 +21,12 @@ import os
 
 import vncmatch
 
+# file names of the images of the calculator buttons
+BUTTON_PATHS = {
+    button: os.path.join('images', f'button_{button:s}.png')
+    for button in ('1', '2', '3', '9', 'clear', 'equals', 'plus')
+}
+
 
 def test_xcalc(vnc):
     """
@@ -37,11 +43,13 @@ def test_xcalc(vnc):
     # move mouse pointer out of the way (just in case it is just at the
     # wrong position at start an makes screen matching fail)
     vnc.move(0, 0)
+    # find all needed buttons of the calculator at once
+    buttons = ('clear', '2', '3', 'plus', '1', '9', 'equals')
+    but_coords = vncm.expect_single_img_batch(
+        [BUTTON_PATHS[button] for button in buttons])
     # click some buttons of the calulator
-    for button in ('clear', '2', '3', 'plus', '1', '9', 'equals'):
-        # find the button of the calculator and click it
-        but_x, but_y = vncm.expect_single_img(
-            os.path.join('images', f'button_{button:s}.png'))
+    for button in buttons:
+        but_x, but_y = but_coords[BUTTON_PATHS[button]]
         vnc.move(but_x, but_y)
         vnc.click()
     # check that the result "42" can be found on the calculator's display
@@ -59,8 +67,7 @@ def test_xcalc_fail(vnc):
     # wrong position at start an makes screen matching fail)
     vnc.move(0, 0)
     # clear calculator
-    but_x, but_y = vncm.expect_single_img(
-        os.path.join('images', f'button_clear.png'))
+    but_x, but_y = vncm.expect_single_img(BUTTON_PATHS['clear'])
     vnc.move(but_x, but_y)
     vnc.click()
     # type some numbers
@@ -85,8 +92,7 @@ def test_xcalc_timeout(vnc):
     # wrong position at start an makes screen matching fail)
     vnc.move(0, 0)
     # clear calculator
-    but_x, but_y = vncm.expect_single_img(
-        os.path.join('images', f'button_clear.png'))
+    but_x, but_y = vncm.expect_single_img(BUTTON_PATHS['clear'])
     vnc.move(but_x, but_y)
     vnc.click()
     # type some numbers
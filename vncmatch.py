@@ -18,32 +18,361 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import concurrent.futures
 import dataclasses
 import json
 import os
 import numpy
 import pytest_vnc
+import stat
+import threading
 import time
-from typing import List, Optional, Tuple
+from typing import ClassVar, Dict, List, Optional, Tuple
 import cv2
 
+# cache of search images loaded from file, to avoid reading and decoding the
+# same file again and again (e.g. when waiting for an image with a timeout),
+# file name -> ((modification time in ns, file size), image, RGB image)
+_TEMPLATE_CACHE: Dict[str, Tuple[Tuple[int, int], numpy.array,
+                                 numpy.array]] = {}
+
+
+def _cuda_available() -> bool:
+    """
+    Check if OpenCV has been built with CUDA support and a CUDA device is
+    present.
+    """
+    try:
+        return cv2.cuda.getCudaEnabledDeviceCount() > 0
+    except (AttributeError, cv2.error):
+        return False
+
+
+# per thread CUDA template matcher and device buffers (created on first use)
+# if a CUDA device is available, None otherwise,
+# the matchers keep intermediate results in internal buffers, so they must
+# not be used by multiple threads at the same time
+_CUDA_LOCAL: Optional[threading.local] = (threading.local()
+                                          if _cuda_available() else None)
+
+
+def _ccorr(screen: numpy.array, img: numpy.array) -> numpy.array:
+    """
+    Compute the cross correlation (like TM_CCORR) of a single channel image at
+    all positions on a single channel screen, on the GPU if available.
+    screen -- single channel OpenCV2 image of the screen, uint8
+    img -- single channel OpenCV2 image to search, uint8
+    """
+    if _CUDA_LOCAL is None:
+        # OpenCV2 already computes this via blockwise DFT on the CPU, which is
+        # faster than a separate FFT of the whole screen
+        return cv2.matchTemplate(screen, img, method=cv2.TM_CCORR)
+    if not hasattr(_CUDA_LOCAL, 'matcher'):
+        # device buffers are reused for all calls and only reallocated if
+        # the size changes
+        _CUDA_LOCAL.matcher = cv2.cuda.createTemplateMatching(
+            cv2.CV_8U, cv2.TM_CCORR)
+        _CUDA_LOCAL.gpu_screen = cv2.cuda_GpuMat()
+        _CUDA_LOCAL.gpu_img = cv2.cuda_GpuMat()
+    _CUDA_LOCAL.gpu_screen.upload(numpy.ascontiguousarray(screen))
+    _CUDA_LOCAL.gpu_img.upload(numpy.ascontiguousarray(img))
+    return _CUDA_LOCAL.matcher.match(_CUDA_LOCAL.gpu_screen,
+                                     _CUDA_LOCAL.gpu_img).download()
+
+
+def _sqsum_integral(screen: numpy.array) -> numpy.array:
+    """
+    Compute the integral image of the squared screen, summed over all channels.
+    screen -- OpenCV2 image
+    """
+    screen_h, screen_w = screen.shape[:2]
+    channels = screen.size // (screen_h * screen_w)
+    # treat channels as additional columns, so every channels-th column of the
+    # integral image contains the sum over all channels
+    screen_flat = numpy.ascontiguousarray(screen).reshape(screen_h, -1)
+    _sum, sqsum = cv2.integral2(screen_flat,
+                                sdepth=cv2.CV_64F,
+                                sqdepth=cv2.CV_64F)
+    return sqsum[:, ::channels]
+
+
+def _match_sqdiff(screen: numpy.array, screen_sqsum: numpy.array,
+                  img: numpy.array) -> numpy.array:
+    """
+    Compute the sum of squared differences (like TM_SQDIFF) of the image at
+    all positions on the screen. The sum is split into sum of squares of the
+    image, sum of squares of the screen under the image (box sums from the
+    integral image) and the cross correlation (TM_CCORR).
+    screen -- OpenCV2 image of the screen
+    screen_sqsum -- integral image of the squared screen (see _sqsum_integral)
+    img -- OpenCV2 image to search, same type as screen
+    """
+    img_h, img_w = img.shape[:2]
+    # cross correlation per channel, as OpenCV is a lot faster on single
+    # channel images than on multi-channel images
+    corr = sum(
+        _ccorr(screen_ch, img_ch)
+        for screen_ch, img_ch in zip(cv2.split(screen), cv2.split(img)))
+    ii = screen_sqsum
+    sqdiff = (ii[img_h:, img_w:] - ii[:-img_h, img_w:] - ii[img_h:, :-img_w] +
+              ii[:-img_h, :-img_w])
+    sqdiff -= 2.0 * corr
+    sqdiff += numpy.square(img, dtype=numpy.float64).sum()
+    return sqdiff
+
+
+@dataclasses.dataclass
+class _PreparedScreen:
+    """
+    Screen prepared for searching images on it (see _match_coarse_to_fine).
+    This only depends on the screen, so it can be shared by all searches on
+    the same screen.
+    rgb -- RGB image of the screen, without the alpha channel of the capture
+    phases -- (phase y, phase x) -> (grayscale phase of screen,
+                                     integral image of squared phase)
+    """
+    rgb: numpy.array
+    phases: Dict[Tuple[int, int], Tuple[numpy.array, numpy.array]]
+    # integral image of the squared RGB screen, computed on first use
+    _sqsum: Optional[numpy.array] = None
+    _sqsum_lock: threading.Lock = dataclasses.field(
+        default_factory=threading.Lock, repr=False)
+
+    def sqsum(self) -> numpy.array:
+        """
+        Get the integral image of the squared RGB screen (see _sqsum_integral).
+        It is only needed for a full search, so it is computed on first use,
+        once for all searches on the screen (which may run in parallel).
+        """
+        with self._sqsum_lock:
+            if self._sqsum is None:
+                self._sqsum = _sqsum_integral(self.rgb)
+            return self._sqsum
+
+
+def _prepare_screen(screen: numpy.array) -> _PreparedScreen:
+    """
+    Prepare the screen for searching images on it: drop the alpha channel,
+    and for the coarse search convert to grayscale and split into the four
+    subsampled phases.
+    screen -- RGBA image of the screen, as captured by pytest_vnc
+    """
+    screen_rgb = cv2.cvtColor(screen, cv2.COLOR_RGBA2RGB)
+    screen_gray = cv2.cvtColor(screen_rgb, cv2.COLOR_RGB2GRAY)
+    phases = {}
+    for phase_y in range(2):
+        for phase_x in range(2):
+            screen_sub = numpy.ascontiguousarray(screen_gray[phase_y::2,
+                                                             phase_x::2])
+            phases[(phase_y, phase_x)] = (screen_sub,
+                                          _sqsum_integral(screen_sub))
+    return _PreparedScreen(rgb=screen_rgb, phases=phases)
+
+
+# sum of the squared weights of the grayscale conversion of OpenCV2
+_GRAY_WEIGHTS_SQ = 0.114**2 + 0.587**2 + 0.299**2
+
+# maximum error of the difference of two gray values due to rounding them to
+# integers (0.5 each plus error of OpenCV2's fixed point conversion)
+_GRAY_DIFF_ROUNDING = 1.01
+
+# maximum number of candidate positions from the coarse search that are
+# checked individually, a full search is done if there are more candidates
+_MAX_CANDIDATES = 1000
+
+# number of horizontal bands for a full search that may stop early
+_FULL_SEARCH_BANDS = 4
+
+
+def _peaks_and_boxes(hit_y: numpy.array, hit_x: numpy.array,
+                     hit_values: numpy.array, img_h: int,
+                     img_w: int) -> numpy.array:
+    """
+    Keep only the best of close-by matches (non-maximum suppression) and
+    return their coordinates. A match is dropped if there is a better match
+    (smaller sum of squared differences, or equal and earlier in raster order)
+    within the window of image size around it. Positions that are not matches
+    can never be better than a match, so only the matches are considered.
+    hit_y, hit_x -- top-left coordinates of matches, in raster order
+    hit_values -- sum of squared differences of matches
+    img_h, img_w -- size of the searched image
+    return -- array of (x left, y top, x right, y bottom) of remaining
+              matches, in raster order
+    """
+    count = len(hit_values)
+    # rank of matches: best first, raster order for equally good ones
+    rank = numpy.empty(count, numpy.int64)
+    rank[numpy.argsort(hit_values, kind='stable')] = numpy.arange(count)
+    if count <= _MAX_CANDIDATES:
+        # compare all pairs of matches
+        d_y = hit_y[numpy.newaxis, :] - hit_y[:, numpy.newaxis]
+        d_x = hit_x[numpy.newaxis, :] - hit_x[:, numpy.newaxis]
+        in_window = ((d_y >= -(img_h // 2)) & (d_y < img_h - img_h // 2) &
+                     (d_x >= -(img_w // 2)) & (d_x < img_w - img_w // 2))
+        better = rank[numpy.newaxis, :] < rank[:, numpy.newaxis]
+        keep = ~(in_window & better).any(axis=1)
+    else:
+        # minimum of rank image within window is rank of best match there
+        rank_img = numpy.full((hit_y.max() + 1, hit_x.max() + 1), count,
+                              numpy.float32)
+        rank_img[hit_y, hit_x] = rank
+        best = cv2.erode(rank_img, numpy.ones((img_h, img_w), numpy.uint8))
+        keep = best[hit_y, hit_x] == rank
+    peak_y, peak_x = hit_y[keep], hit_x[keep]
+    return numpy.stack(
+        [peak_x, peak_y, peak_x + img_w - 1, peak_y + img_h - 1], axis=1)
+
+
+def _match_coarse_to_fine(
+    prepared: _PreparedScreen,
+    img: numpy.array,
+    threshold: float,
+    max_matches: Optional[int] = None
+) -> Tuple[numpy.array, numpy.array, numpy.array]:
+    """
+    Find all positions on the screen at which the sum of squared differences
+    of the image is not larger than the threshold.
+    The coarse search only uses every second pixel of the image in both
+    directions, i.e. it matches the subsampled image against the four
+    subsampled phases of the screen. It is done on 8 bit grayscale images:
+    the exact gray difference d is a weighted sum of the color differences,
+    so d^2 is at most the sum of the squared weights times the sum of the
+    squared color differences. Rounding the gray values changes d by at most
+    e, so the rounded difference squared is at most 2 d^2 + 2 e^2. Summing
+    this up gives a bound for the coarse search that is not exceeded at any
+    position at which the full sum of squared differences is not larger than
+    the threshold, so only positions not exceeding it in the coarse search
+    need to be checked with the full image.
+    prepared -- prepared screen (see _prepare_screen)
+    img -- RGB image to search
+    threshold -- maximum sum of squared differences of interest
+    max_matches -- if not None, the search may stop as soon as more matches
+                   (after non-maximum suppression) have been found
+    return -- (y top, x left, sum of squared differences) of matches,
+              in raster order
+    """
+    screen = prepared.rgb
+    screen_h, screen_w = screen.shape[:2]
+    img_h, img_w = img.shape[:2]
+    out_h, out_w = screen_h - img_h + 1, screen_w - img_w + 1
+    # coarse search: lower bound of sum of squared differences
+    img_sub = cv2.cvtColor(img, cv2.COLOR_RGB2GRAY)[::2, ::2]
+    coarse_threshold = (2.0 * _GRAY_WEIGHTS_SQ * threshold +
+                        2.0 * _GRAY_DIFF_ROUNDING**2 * img_sub.size)
+    cand_y_list, cand_x_list = [], []
+    for (phase_y, phase_x), (screen_sub, screen_sub_sqsum) in \
+            prepared.phases.items():
+        if phase_y >= out_h or phase_x >= out_w:
+            continue
+        values = _match_sqdiff(screen_sub, screen_sub_sqsum, img_sub)
+        sub_y, sub_x = numpy.nonzero(values <= coarse_threshold)
+        cand_y, cand_x = phase_y + 2 * sub_y, phase_x + 2 * sub_x
+        inside = (cand_y < out_h) & (cand_x < out_w)
+        cand_y_list.append(cand_y[inside])
+        cand_x_list.append(cand_x[inside])
+    cand_y = numpy.concatenate(cand_y_list)
+    cand_x = numpy.concatenate(cand_x_list)
+    # too many candidates -> full search is cheaper
+    if len(cand_y) > _MAX_CANDIDATES:
+        # search band by band if allowed to stop early, stop if too many
+        # matches have been found, matches are final if no other position in
+        # their suppression window is still unknown, at most one band per row
+        # of positions, so no band is empty
+        bands = 1 if max_matches is None else min(_FULL_SEARCH_BANDS, out_h)
+        hit_y_list, hit_x_list, hit_values_list = [], [], []
+        for band in range(bands):
+            y0, y1 = out_h * band // bands, out_h * (band + 1) // bands
+            # box sums of the band from the integral image of the screen
+            values = _match_sqdiff(screen[y0:y1 + img_h - 1],
+                                   prepared.sqsum()[y0:y1 + img_h], img)
+            band_y, band_x = numpy.nonzero(values <= threshold)
+            hit_y_list.append(y0 + band_y)
+            hit_x_list.append(band_x)
+            hit_values_list.append(values[band_y, band_x])
+            if max_matches is not None:
+                hit_y = numpy.concatenate(hit_y_list)
+                coords = _peaks_and_boxes(hit_y, numpy.concatenate(hit_x_list),
+                                          numpy.concatenate(hit_values_list),
+                                          img_h, img_w)
+                final_h = y1 - img_h + img_h // 2
+                if numpy.count_nonzero(coords[:, 1] < final_h) > max_matches:
+                    break
+        return (numpy.concatenate(hit_y_list), numpy.concatenate(hit_x_list),
+                numpy.concatenate(hit_values_list))
+    # fine search: full image at candidate positions
+    order = numpy.lexsort((cand_x, cand_y))
+    cand_y, cand_x = cand_y[order], cand_x[order]
+    values = numpy.array([
+        cv2.norm(screen[y:y + img_h, x:x + img_w], img, cv2.NORM_L2SQR)
+        for y, x in zip(cand_y, cand_x)
+    ])
+    is_match = values <= threshold
+    return cand_y[is_match], cand_x[is_match], values[is_match]
+
+
+def _to_rgb(img: numpy.array) -> numpy.array:
+    """
+    Convert an OpenCV2 image (BGR) to the channel order of the VNC screen
+    (RGB) for matching against it.
+    img -- OpenCV2 image
+    """
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _load_img(imgname: str) -> Tuple[numpy.array, numpy.array]:
+    """
+    Load an image to search from file, use cached image unless the file has
+    changed since it has been loaded.
+    imgname -- file name of image
+    return -- (OpenCV2 image, i.e. BGR, RGB image for matching)
+    """
+    try:
+        st = os.stat(imgname)
+    except OSError:
+        st = None
+    is_file = st is not None and stat.S_ISREG(st.st_mode)
+    assert is_file, f'image file {imgname:s} is missing'
+    key = (st.st_mtime_ns, st.st_size)
+    hit = _TEMPLATE_CACHE.get(imgname)
+    if hit is not None and hit[0] == key:
+        return hit[1], hit[2]
+    img = cv2.imread(imgname, cv2.IMREAD_COLOR)
+    img_rgb = _to_rgb(img)
+    _TEMPLATE_CACHE[imgname] = (key, img, img_rgb)
+    return img, img_rgb
+
 
 @dataclasses.dataclass
 class FindResult:
     """
     Result of an image search operation on the VNC screen.
-    img -- the image that has been searched
-    screen -- screenshot of the VNC screen
+    img -- the image that has been searched (OpenCV2 image, i.e. BGR)
+    screen -- screenshot of the VNC screen (OpenCV2 image, i.e. BGR),
+              converted from the capture on first use
     matches -- image with color 1 at each position at which the top-left corner
                of the seach image has been found
     coord_list -- list of coordinates of found images,
                   list of (x left, y top, x right, y bottom)
     """
     img: Optional[numpy.array]
-    screen: numpy.array
+    _capture: numpy.array  # screen as captured by pytest_vnc (RGBA)
     matches: Optional[numpy.array] = None
     coord_list: List[Tuple[int, int]] = dataclasses.field(
         default_factory=list)  # list of (left x, top y, right x, bottom y)
+    _screen: Optional[numpy.array] = dataclasses.field(default=None,
+                                                       init=False,
+                                                       repr=False)
+    # buffer for matches image with border, reused for all output
+    _border_buf: ClassVar[Optional[numpy.array]] = None
+
+    @property
+    def screen(self) -> numpy.array:
+        """
+        Screenshot of the VNC screen (OpenCV2 image, i.e. BGR).
+        """
+        if self._screen is None:
+            self._screen = cv2.cvtColor(self._capture, cv2.COLOR_RGBA2BGR)
+        return self._screen
 
     def _write_image(self, imgname: str, img: Optional[numpy.array]):
         """
@@ -62,8 +391,9 @@ class FindResult:
         # make output directory
         os.makedirs(dirname, exist_ok=True)
         # write search image (or delete it) and screen image
+        screen = self.screen
         self._write_image(os.path.join(dirname, 'img.png'), self.img)
-        self._write_image(os.path.join(dirname, 'screen.png'), self.screen)
+        self._write_image(os.path.join(dirname, 'screen.png'), screen)
         # write coordinates
         with open(os.path.join(dirname, 'coord_list.json'), 'w') as c_l_f:
             json.dump(self.coord_list, c_l_f, indent='  ')
@@ -72,23 +402,33 @@ class FindResult:
         found: Optional[numpy.array] = None
         if self.img is not None and self.matches is not None:
             img_h, img_w, _channels = self.img.shape
-            screen_h, screen_w, _channels = self.screen.shape
-            # add black border
-            matches_border = cv2.copyMakeBorder(self.matches, img_h - 1,
-                                                img_h - 1, img_w - 1,
-                                                img_w - 1, cv2.BORDER_CONSTANT,
-                                                0)
-            # filter with filled rectangle of search image size
-            matches_mask = cv2.filter2D(matches_border, -1,
-                                        numpy.ones((img_h, img_w)))
+            # add black border, reuse buffer if large enough
+            matches_h, matches_w = self.matches.shape
+            border_h = matches_h + 2 * (img_h - 1)
+            border_w = matches_w + 2 * (img_w - 1)
+            buf = FindResult._border_buf
+            if (buf is None or buf.shape[0] < border_h
+                    or buf.shape[1] < border_w):
+                buf = numpy.empty((border_h, border_w), numpy.uint8)
+                FindResult._border_buf = buf
+            matches_border = buf[:border_h, :border_w]
+            matches_border[:img_h - 1] = 0
+            matches_border[img_h - 1 + matches_h:] = 0
+            matches_border[:, :img_w - 1] = 0
+            matches_border[:, img_w - 1 + matches_w:] = 0
+            matches_border[img_h - 1:img_h - 1 + matches_h,
+                           img_w - 1:img_w - 1 + matches_w] = self.matches
+            # sum up matches in rectangles of search image size using the
+            # integral image, the result has the size of the original screen
+            ii = cv2.integral(matches_border, sdepth=cv2.CV_32S)
+            matches_sum = (ii[img_h:, img_w:] - ii[:-img_h, img_w:] -
+                           ii[img_h:, :-img_w] + ii[:-img_h, :-img_w])
             # everything that touched the rectangle -> 1, everything else -> 0
-            matches_mask = matches_mask.clip(0, 1).astype(numpy.uint8)
-            # cut out section of resulting mask at position of original screen
-            matches_mask = matches_mask[img_h // 2:img_h // 2 + screen_h,
-                                        img_w // 2:img_w // 2 + screen_w]
+            matches_mask = (matches_sum > 0).astype(numpy.uint8)
             # found image: darkened screen with found search images highlighted
-            found = self.screen / 2 + cv2.cvtColor(matches_mask,
-                                                   cv2.COLOR_GRAY2BGR) * 128
+            found = cv2.addWeighted(
+                screen, 0.5, cv2.cvtColor(matches_mask, cv2.COLOR_GRAY2BGR),
+                128, 0.0)
         self._write_image(os.path.join(dirname, 'found.png'), found)
 
 
@@ -103,57 +443,139 @@ class VNCMatch:
         vnc -- VNC client object from pytest_vnc
         """
         self._vnc = vnc
+        # last captured screen and last search result, to skip the search if
+        # neither the screen nor the search image has changed,
+        # the screen is kept in RGBA as captured to avoid converting it to
+        # BGR (OpenCV2 convention), it is prepared for searching (see
+        # _prepare_screen) and the search images are converted to RGB
+        self._last_screen: Optional[numpy.array] = None
+        self._last_prepared: Optional[_PreparedScreen] = None
+        self._last_fi_res: Optional[FindResult] = None
+        self._last_max_matches: Optional[int] = None
 
-    def _output_and_fail(self, msg: str, fi_res: FindResult):
+    def _output_error(self, msg: str, fi_res: FindResult) -> str:
         """
         Output error information about a failed image search on screen
-        to directory and fail.
+        to directory.
         msg -- error message
         fi_res -- find result of failed image search
+        return -- error message referring to the directory
         """
         timestamp = time.strftime('%Y%m%d-%H%M%S')
         dirname = os.path.join(
             'vncmatch_fails', ''.join([c if c.isalnum() else '_'
                                        for c in msg]) + '_' + timestamp)
         fi_res.output_imgs(dirname)
-        assert False, f'{msg:s}, see {dirname:s}'
+        return f'{msg:s}, see {dirname:s}'
 
-    def find(self, img: Optional[numpy.array] = None) -> FindResult:
+    def _capture(self, capture: Optional[numpy.array] = None) -> bool:
         """
-        Find the passed image on the VNC screen and return an find object
-        with a screenshot of the screen and all the coordinates at which the
-        image has been found.
+        Capture the VNC screen and remember it as the last screen.
+        capture -- screen that has already been captured, None to capture now
+        return -- if the screen is unchanged since the last capture
+        """
+        if capture is None:
+            capture = self._vnc.capture()
+        if (self._last_screen is not None
+                and numpy.array_equal(capture, self._last_screen)):
+            return True
+        self._last_screen = capture
+        self._last_prepared = None
+        self._last_fi_res = None
+        return False
+
+    def _prepare_search(self):
+        """
+        Prepare the last captured screen for searching images on it.
+        This needs to be done before searching in multiple threads.
+        """
+        if self._last_prepared is None:
+            self._last_prepared = _prepare_screen(self._last_screen)
+
+    def _search(self, img: Optional[numpy.array],
+                img_rgb: Optional[numpy.array],
+                max_matches: Optional[int]) -> FindResult:
+        """
+        Search the image on the last captured screen (see find).
         img -- OpenCV2 image to search
+        img_rgb -- image to search converted to RGB (see _to_rgb)
+        max_matches -- maximum number of matches of interest (see find)
         """
-        # capture screen
-        screen = cv2.cvtColor(self._vnc.capture(), cv2.COLOR_RGB2BGR)
-        fi_res = FindResult(img=img, screen=screen)
+        screen = self._last_screen
+        fi_res = FindResult(img=img, _capture=screen)
         if img is None:
             return fi_res  # no search image -> return screen and no findings
         # find search image on screen
-        match_values = cv2.matchTemplate(screen, img, method=cv2.TM_SQDIFF)
-        # top-left coordinates of found images have a 1 in the matches image
-        fi_res.matches = (match_values <=
-                          0.5 * img.shape[0] * img.shape[1]).astype(int)
-        # get coordinates of found positions
-        # store as list of (x left, y top, x right, y bottom)
-        where = numpy.where(fi_res.matches)
-        left_top = zip([int(x) for x in where[1]], [int(y) for y in where[0]])
         img_h, img_w, _channels = img.shape
-        fi_res.coord_list = [(xl, yt, xl + img_w - 1, yt + img_h - 1)
-                             for xl, yt in left_top]
+        threshold = 0.5 * img_h * img_w
+        self._prepare_search()
+        hit_y, hit_x, hit_values = _match_coarse_to_fine(
+            self._last_prepared, img_rgb, threshold, max_matches)
+        # get coordinates of found positions, keep only the best of close-by
+        # matches, store as list of (x left, y top, x right, y bottom)
+        coords = _peaks_and_boxes(hit_y, hit_x, hit_values, img_h, img_w)
+        fi_res.coord_list = [tuple(c) for c in coords.tolist()]
+        # top-left coordinates of found images have a 1 in the matches image
+        screen_h, screen_w, _channels = screen.shape
+        fi_res.matches = numpy.zeros(
+            (screen_h - img_h + 1, screen_w - img_w + 1), numpy.uint8)
+        fi_res.matches[coords[:, 1], coords[:, 0]] = 1
+        return fi_res
+
+    def find(self,
+             img: Optional[numpy.array] = None,
+             max_matches: Optional[int] = None) -> FindResult:
+        """
+        Find the passed image on the VNC screen and return an find object
+        with a screenshot of the screen and all the coordinates at which the
+        image has been found. Of multiple matches closer than half the image
+        size to each other, only the best one is reported.
+        img -- OpenCV2 image to search
+        max_matches -- if not None, the search may stop as soon as more than
+                       this number of matches have been found, i.e. not all
+                       matches might be reported then and close-by matches
+                       at the end of the searched area might not be reduced
+                       to the best one
+        """
+        return self._find(img, None if img is None else _to_rgb(img),
+                          max_matches)
+
+    def _find(self, img: Optional[numpy.array],
+              img_rgb: Optional[numpy.array],
+              max_matches: Optional[int]) -> FindResult:
+        """
+        Find the passed image on the VNC screen (see find).
+        img -- OpenCV2 image to search
+        img_rgb -- image to search converted to RGB (see _to_rgb)
+        max_matches -- maximum number of matches of interest (see find)
+        """
+        # capture screen
+        if self._capture():
+            # same screen and same search image -> same result
+            last = self._last_fi_res
+            if (img is not None and last is not None
+                    and numpy.array_equal(img, last.img)
+                    and self._last_max_matches == max_matches):
+                return dataclasses.replace(last,
+                                           coord_list=list(last.coord_list))
+        fi_res = self._search(img, img_rgb, max_matches)
+        self._last_fi_res = fi_res
+        self._last_max_matches = max_matches
         return fi_res
 
-    def find_img(self, imgname: str) -> FindResult:
+    def find_img(self,
+                 imgname: str,
+                 max_matches: Optional[int] = None) -> FindResult:
         """
         Find an image on the VNC screen and return an find object with a
         screenshot of the screen and all the coordinates at which the image
         has been found.
         imgname -- file name of image to search
+        max_matches -- if not None, the search may stop as soon as more than
+                       this number of matches have been found
         """
-        assert os.path.isfile(imgname), f'image file {imgname:s} is missing'
-        img = cv2.imread(imgname, cv2.IMREAD_COLOR)
-        return self.find(img)
+        img, img_rgb = _load_img(imgname)
+        return self._find(img, img_rgb, max_matches)
 
     def expect_single_img(self,
                           imgname: str,
@@ -168,21 +590,96 @@ class VNCMatch:
                    image to appear on the screen
         return -- (x, y) of center of image on the screen
         """
-        # try while timeout is not expired
-        end = time.time() + timeout
-        while True:
-            # find image
-            fi_res = self.find_img(imgname)
-            # found -> retun middle coordinate of found image
-            if len(fi_res.coord_list) == 1:
-                xl, yt, xr, yb = fi_res.coord_list[0]
-                return ((xl + xr) // 2, (yt + yb) // 2)
-            # timeout expired -> leave loop
-            if time.time() > end:
-                break
-            # wait a bit
-            time.sleep(0.1 * timeout)
-        # error - either not found or multiple found
-        self._output_and_fail(
-            'image found multiple times'
-            if len(fi_res.coord_list) > 1 else 'image not found', fi_res)
\ No newline at end of file
+        return self.expect_single_img_batch([imgname], timeout)[imgname]
+
+    def expect_single_img_batch(
+            self,
+            imgnames: List[str],
+            timeout: float = 0.0) -> Dict[str, Tuple[int, int]]:
+        """
+        Check that each of the images is found exactly once on the same
+        screen and return the locations. The images are searched in parallel.
+        If any image is not found or found multiple times, output error
+        information for each such image to a directory and fail.
+        imgnames -- file names of images to search
+        timeout -- wait for the specified number of seconds for all the
+                   single images to appear on the screen
+        return -- dict: file name -> (x, y) of center of image on the screen
+        """
+        if not imgnames:
+            return {}
+        imgs = {imgname: _load_img(imgname) for imgname in imgnames}
+        # search multiple images in parallel, a single image directly unless
+        # retrying (to capture the next screen while searching)
+        executor: Optional[concurrent.futures.ThreadPoolExecutor] = None
+        try:
+            # try while timeout is not expired
+            end = time.time() + timeout
+            delay = 0.02
+            fi_res_dict: Dict[str, FindResult] = {}
+            capture_time = time.time()
+            unchanged = self._capture()
+            while True:
+                # capture next screen after waiting a bit, start with short
+                # waits and wait longer each time, capture the last screen
+                # when the timeout expires
+                next_time = min(capture_time + delay, end)
+                capture: Optional[numpy.array] = None
+                # find images, unless screen has not changed since last try
+                if not unchanged or not fi_res_dict:
+                    self._prepare_search()
+                    if executor is None and (len(imgs) > 1 or fi_res_dict):
+                        executor = concurrent.futures.ThreadPoolExecutor(
+                            min(len(imgs), os.cpu_count() or 1))
+                    if executor is None:
+                        fi_res_dict = {
+                            imgname: self._search(img, img_rgb, 1)
+                            for imgname, (img, img_rgb) in imgs.items()
+                        }
+                    else:
+                        futures = [
+                            executor.submit(self._search, img, img_rgb, 1)
+                            for img, img_rgb in imgs.values()
+                        ]
+                        # search takes longer than waiting -> capture next
+                        # screen while still searching
+                        if capture_time < end:
+                            _done, pending = concurrent.futures.wait(
+                                futures, max(next_time - time.time(), 0.0))
+                            if pending:
+                                capture_time = time.time()
+                                capture = self._vnc.capture()
+                        fi_res_dict = dict(
+                            zip(imgs, [future.result() for future in futures]))
+                # all found -> return middle coordinates of found images
+                failed = {
+                    imgname: fi_res
+                    for imgname, fi_res in fi_res_dict.items()
+                    if len(fi_res.coord_list) != 1
+                }
+                if not failed:
+                    middles = {}
+                    for imgname, fi_res in fi_res_dict.items():
+                        xl, yt, xr, yb = fi_res.coord_list[0]
+                        middles[imgname] = ((xl + xr) // 2, (yt + yb) // 2)
+                    return middles
+                if capture is None:
+                    # screen captured after timeout expired -> leave loop
+                    if capture_time >= end:
+                        break
+                    time.sleep(max(next_time - time.time(), 0.0))
+                    capture_time = time.time()
+                    capture = self._vnc.capture()
+                unchanged = self._capture(capture)
+                delay = min(delay * 1.7, 0.25)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        # error - either not found or multiple found, for each failed image
+        errors = []
+        for imgname, fi_res in failed.items():
+            problem = ('found multiple times'
+                       if len(fi_res.coord_list) > 1 else 'not found')
+            errors.append(
+                self._output_error(f'image {imgname:s} {problem:s}', fi_res))
+        assert False, '; '.join(errors)